@@ -0,0 +1,370 @@
+#! /usr/bin/env python
+"""
+Python module for evaluating threshold alarms on TSI Flow Meter measurements
+"""
+__author__ = "Ben Johnston"
+__revision__ = "0.1"
+__date__ = ""
+__copyright__ = "GPL License"
+
+##IMPORTS#####################################################################
+from TSILogger import logger
+import threading
+import Queue
+import time
+##############################################################################
+
+
+#Define an exception class
+class TSIException(Exception):
+    """!
+    Class to handle exceptions within the TSI module
+    """
+    def __init__(self, msg=None):
+        """!
+        The constructor for the class.
+        @param self The pointer for the object
+        @param msg The message to be displayed within the exception
+        """
+        Exception.__init__(self, msg)
+        ##@var msg
+        #The message to report for the exception
+        self.msg = msg
+
+    def __str__(self):
+        """!
+        This method provides a string representation of the exception
+        @param self The pointer for the object
+        @return A string representation of the exceptions
+        """
+        return self.msg
+
+
+class TSIAlarmRule(object):
+    """!
+    A single alarm condition on one measurement channel.  The alarm is raised
+    once every sample has exceeded the limit for duration seconds and is
+    cleared once the measurement has returned past the limit by the
+    hysteresis.
+    """
+
+    #Rule types
+    HIGH = 'high'
+    LOW = 'low'
+    RATE = 'rate'
+
+    #Alarm states
+    RAISED = 'raised'
+    CLEARED = 'cleared'
+
+    def __init__(self, channel, kind, limit, hysteresis=0.0, duration=0.0,
+                 callback=None, name=None):
+        """!
+        The constructor for the class
+        @param self The pointer for the object
+        @param channel The measurement channel, 'flow', 'temp' or 'press'
+        @param kind TSIAlarmRule.HIGH to alarm above limit, TSIAlarmRule.LOW
+        to alarm below limit or TSIAlarmRule.RATE to alarm when the rate of
+        change exceeds limit units per second in either direction
+        @param limit The alarm limit
+        @param hysteresis The distance the measurement must return past the
+        limit before a raised alarm is cleared
+        @param duration The time in seconds the condition must hold before
+        the alarm is raised
+        @param callback Called as callback(event) when the alarm is raised or
+        cleared.  See TSIAlarmMonitor for the contents of event
+        @param name An optional name used to identify the rule
+        """
+        if kind not in (TSIAlarmRule.HIGH, TSIAlarmRule.LOW,
+                        TSIAlarmRule.RATE):
+            raise TSIException('Unknown alarm type: %s' % kind)
+        if hysteresis < 0:
+            raise TSIException('The hysteresis must not be negative')
+        self.channel = channel
+        self.kind = kind
+        self.limit = limit
+        self.hysteresis = hysteresis
+        self.duration = duration
+        self.callback = callback
+        if name is None:
+            name = '%s %s %s' % (channel, kind, limit)
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        """!
+        Return the rule to its initial state
+        @param self The pointer for the object
+        """
+        ##@var raised
+        #True while the alarm is raised
+        self.raised = False
+        #The time from which every sample has exceeded the limit, while the
+        #alarm is not raised
+        self._since = None
+        #The previous sample, used by RATE rules
+        self._previous = None
+
+    def evaluate(self, values, timestamps):
+        """!
+        Evaluate the rule against a batch of new samples
+        @param self The pointer for the object
+        @param values A list of the new samples for the channel
+        @param timestamps A list of the time of each sample in seconds
+        @return A list of (state, value, time) tuples for each change in the
+        alarm state
+        """
+        if not values:
+            return []
+        if self.kind == TSIAlarmRule.RATE:
+            values, timestamps = self._rates(values, timestamps)
+            if not values:
+                return []
+            values = [abs(value) for value in values]
+            limit = self.limit
+            high = True
+        else:
+            limit = self.limit
+            high = self.kind == TSIAlarmRule.HIGH
+        #Check the whole batch at once, if the alarm is not raised and no
+        #sample exceeds the limit the batch can be skipped
+        if not self.raised:
+            if (high and (max(values) <= limit)) or \
+                    ((not high) and (min(values) >= limit)):
+                self._since = None
+                return []
+        if high:
+            clear = limit - self.hysteresis
+        else:
+            clear = limit + self.hysteresis
+        events = []
+        for value, stamp in zip(values, timestamps):
+            if self.raised:
+                #The hysteresis only applies to clearing a raised alarm
+                if (high and value < clear) or \
+                        ((not high) and value > clear):
+                    self.raised = False
+                    events.append((TSIAlarmRule.CLEARED, value, stamp))
+                continue
+            if (high and value <= limit) or ((not high) and value >= limit):
+                #The condition must hold for every sample over the duration
+                self._since = None
+                continue
+            if self._since is None:
+                self._since = stamp
+            #Allow for rounding of the timestamps when checking the duration
+            if stamp - self._since >= self.duration - 1e-9:
+                self.raised = True
+                self._since = None
+                events.append((TSIAlarmRule.RAISED, value, stamp))
+        return events
+
+    def _rates(self, values, timestamps):
+        """!
+        Compute the rate of change between successive samples
+        @param self The pointer for the object
+        @param values A list of the new samples for the channel
+        @param timestamps A list of the time of each sample in seconds
+        @return A tuple of the list of rates and the list of times
+        """
+        if self._previous is not None:
+            values = [self._previous[0]] + list(values)
+            timestamps = [self._previous[1]] + list(timestamps)
+        self._previous = (values[-1], timestamps[-1])
+        rates = []
+        times = []
+        for i in range(1, len(values)):
+            interval = timestamps[i] - timestamps[i - 1]
+            if interval <= 0:
+                continue
+            rates.append((values[i] - values[i - 1]) / interval)
+            times.append(timestamps[i])
+        return rates, times
+
+
+class TSIAlarmMonitor(object):
+    """!
+    A class used to evaluate TSIAlarmRule instances against measurements as
+    they are received.  Only the new samples are evaluated on each call, so
+    the time taken does not depend upon the length of the run.  Callbacks are
+    executed on a separate thread for each rule so that they do not delay the
+    reading of data from the device, or the callbacks of other rules.
+
+    Each event passed to a callback is a dictionary containing 'rule',
+    'name', 'channel', 'state' (TSIAlarmRule.RAISED or
+    TSIAlarmRule.CLEARED), 'value' and 'time'.  For RATE rules 'value' is the
+    magnitude of the rate of change.
+    """
+
+    def __init__(self, rules=None, debug_level=0):
+        """!
+        The constructor for the class
+        @param self The pointer for the object
+        @param rules A list of TSIAlarmRule instances
+        @param debug_level Controls debugging functionality for the class
+        """
+        self.rules = []
+        if rules is not None:
+            for rule in rules:
+                self.add_rule(rule)
+        self.debug_level = debug_level
+        self.info_logger = logger(debug_level=self.debug_level)
+        #The (queue, thread) used to execute the callbacks of each rule,
+        #keyed by the id of the rule
+        self._dispatchers = {}
+        self._lock = threading.Lock()
+
+    def add_rule(self, rule):
+        """!
+        Add a rule to the monitor
+        @param self The pointer for the object
+        @param rule The TSIAlarmRule to add
+        @return The rule
+        """
+        self.rules.append(rule)
+        return rule
+
+    def start(self):
+        """!
+        Start the threads which execute the callbacks of each rule
+        @param self The pointer for the object
+        """
+        for rule in self.rules:
+            if rule.callback is not None:
+                self._dispatcher_queue(rule)
+
+    def stop(self, wait=True):
+        """!
+        Stop the callback threads once all pending callbacks are complete
+        @param self The pointer for the object
+        @param wait Set to True to block until the threads have finished
+        """
+        with self._lock:
+            dispatchers = self._dispatchers.values()
+            self._dispatchers = {}
+        for events, thread in dispatchers:
+            events.put(None)
+        if wait:
+            for events, thread in dispatchers:
+                thread.join()
+
+    def _dispatcher_queue(self, rule):
+        """!
+        Find the queue used to pass events to the callback thread of a rule,
+        starting the thread if required
+        @param self The pointer for the object
+        @param rule The TSIAlarmRule
+        @return The queue
+        """
+        with self._lock:
+            if id(rule) not in self._dispatchers:
+                events = Queue.Queue()
+                thread = threading.Thread(target=self._dispatcher,
+                                          args=(events,),
+                                          name='TSIAlarmMonitor-%s' %
+                                          rule.name)
+                thread.daemon = True
+                thread.start()
+                self._dispatchers[id(rule)] = (events, thread)
+            return self._dispatchers[id(rule)][0]
+
+    def process(self, data, timestamps=None):
+        """!
+        Evaluate the rules against a batch of new samples
+        @param self The pointer for the object
+        @param data A dictionary of lists of new samples keyed by channel
+        @param timestamps A list of the time of each sample in seconds since
+        the epoch.  If None the current time is used for every sample, in which
+        case a RATE rule cannot be evaluated against more than one sample and
+        a TSIException is raised
+        @return A list of the events generated by the batch
+        """
+        events = []
+        for rule in self.rules:
+            values = data.get(rule.channel)
+            if not values:
+                continue
+            if timestamps is None:
+                if (rule.kind == TSIAlarmRule.RATE) and (len(values) > 1):
+                    raise TSIException('Timestamps are required to evaluate '
+                                       'rate alarm %s' % rule.name)
+                stamps = [time.time()] * len(values)
+            else:
+                stamps = timestamps
+            for state, value, stamp in rule.evaluate(values, stamps):
+                event = {'rule': rule,
+                         'name': rule.name,
+                         'channel': rule.channel,
+                         'state': state,
+                         'value': value,
+                         'time': stamp}
+                events.append(event)
+                self.info_logger.info('Alarm %s %s: %s' %
+                                      (rule.name, state, value))
+                if rule.callback is not None:
+                    self._dispatcher_queue(rule).put(event)
+        return events
+
+    def watch(self, measurements, sample_rate=None):
+        """!
+        Evaluate the rules against the results of TSIMeasure.measure_FTP as
+        they are received.  The results are passed through unchanged so that
+        this may be used in place of the generator.
+        @param self The pointer for the object
+        @param measurements The generator returned by measure_FTP
+        @param sample_rate The sample rate used for the measurements in
+        milliseconds per sample.  If None the time each sample is received is
+        used, see self.process
+        @return A generator yielding the results of measure_FTP
+        """
+        #Only stop the callback threads on completion if they were started
+        #here
+        started = not self._dispatchers
+        self.start()
+        start_time = None
+        #The number of samples of each channel which have been evaluated
+        processed = {}
+        try:
+            for result_dict in measurements:
+                if result_dict is None:
+                    yield result_dict
+                    continue
+                now = time.time()
+                if start_time is None:
+                    start_time = now
+                new = {}
+                count = 0
+                for channel, values in result_dict.items():
+                    first = processed.get(channel, 0)
+                    new[channel] = values[first:]
+                    processed[channel] = len(values)
+                    count = max(count, len(new[channel]))
+                if count:
+                    if sample_rate is None:
+                        timestamps = None
+                    else:
+                        first = max(processed.values()) - count
+                        timestamps = [start_time +
+                                      (first + i) * sample_rate / 1000.0
+                                      for i in range(count)]
+                    self.process(new, timestamps)
+                yield result_dict
+        finally:
+            if started:
+                self.stop()
+
+    def _dispatcher(self, events):
+        """!
+        Execute the callbacks for events generated by self.process
+        @param self The pointer for the object
+        @param events The queue the events of a single rule are received on
+        """
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            try:
+                event['rule'].callback(event)
+            except Exception as e:
+                self.info_logger.info('Callback for alarm %s failed: %s' %
+                                      (event['name'], e))
@@ -0,0 +1,447 @@
+#! /usr/bin/env python
+"""
+Python module for the compressed long term storage of TSI Flow Meter data
+"""
+__author__ = "Ben Johnston"
+__revision__ = "0.1"
+__date__ = ""
+__copyright__ = "GPL License"
+
+##IMPORTS#####################################################################
+from TSILogger import logger
+from datetime import datetime
+import multiprocessing
+import math
+import struct
+import time
+import zlib
+import csv
+import os
+##############################################################################
+
+#Archive file layout
+#Each archive is a sequence of independent chunks so that new data can be
+#appended to an existing file.  Each chunk is made up of:
+#1. A chunk header: 'TSIC', number of rows, number of columns
+#2. For each column: name length, name, scale, minimum, maximum, first
+#   quantized value, delta width ('i' or 'q') and the length of the data
+#3. For each column: the zlib compressed, delta encoded, quantized data
+CHUNK_MAGIC = 'TSIC'
+CHUNK_HEADER = '<4sII'
+COLUMN_HEADER = '<dddqcI'
+
+#The resolution each channel is quantized to prior to compression
+DEFAULT_SCALES = {'time': 0.001,
+                  'flow': 0.001,
+                  'temp': 0.01,
+                  'press': 0.001}
+DEFAULT_SCALE = 0.001
+
+
+#Define an exception class
+class TSIException(Exception):
+    """!
+    Class to handle exceptions within the TSI module
+    """
+    def __init__(self, msg=None):
+        """!
+        The constructor for the class.
+        @param self The pointer for the object
+        @param msg The message to be displayed within the exception
+        """
+        Exception.__init__(self, msg)
+        ##@var msg
+        #The message to report for the exception
+        self.msg = msg
+
+    def __str__(self):
+        """!
+        This method provides a string representation of the exception
+        @param self The pointer for the object
+        @return A string representation of the exceptions
+        """
+        return self.msg
+
+
+def _encode_chunk(args):
+    """!
+    Encode a single chunk of the archive.  This is a module level function so
+    that it may be executed by a multiprocessing pool.
+    @param args A tuple of (columns, scales, compression level) where columns
+    is a list of (name, values) tuples
+    @return The encoded chunk as a string
+    """
+    columns, scales, level = args
+    rows = len(columns[0][1])
+    headers = [struct.pack(CHUNK_HEADER, CHUNK_MAGIC, rows, len(columns))]
+    blobs = []
+    for name, values in columns:
+        scale = scales.get(name, DEFAULT_SCALE)
+        quantized = [int(round(value / scale)) for value in values]
+        deltas = [quantized[i] - quantized[i - 1]
+                  for i in range(1, len(quantized))]
+        if deltas and max(max(deltas), -min(deltas)) >= 2 ** 31:
+            width = 'q'
+        else:
+            width = 'i'
+        blob = zlib.compress(struct.pack('<%d%s' % (len(deltas), width),
+                                         *deltas), level)
+        headers.append(struct.pack('<B', len(name)) + name)
+        headers.append(struct.pack(COLUMN_HEADER, scale,
+                                   min(quantized) * scale,
+                                   max(quantized) * scale, quantized[0],
+                                   width, len(blob)))
+        blobs.append(blob)
+    return ''.join(headers + blobs)
+
+
+def _decode_column(header, blob):
+    """!
+    Decode a single column of a chunk
+    @param header The column header as returned by TSIArchiveReader.chunks
+    @param blob The compressed column data
+    @return A list of the values within the column
+    """
+    data = zlib.decompress(blob)
+    width = header['width']
+    deltas = struct.unpack('<%d%s' % (len(data) // struct.calcsize(width),
+                                      width), data)
+    scale = header['scale']
+    current = header['first']
+    values = [current * scale]
+    for delta in deltas:
+        current += delta
+        values.append(current * scale)
+    return values
+
+
+class TSIArchiver(object):
+    """!
+    A class used to write measurement data to a chunked, compressed, columnar
+    archive file.  Each channel is quantized to a fixed resolution and delta
+    encoded, which suits the slowly varying flow, temperature and pressure
+    measurements.  The minimum and maximum of each column are stored with
+    each chunk so that TSIArchiveReader can skip chunks during range queries.
+
+    Rows are held in memory until chunk_size * processes rows have been
+    buffered, or flush or close is called.  Rows which are still buffered are
+    lost if the program exits before then.
+    """
+
+    def __init__(self, file_name='archive.tsa', chunk_size=4096, scales=None,
+                 compression_level=6, processes=1, debug_level=0):
+        """!
+        The constructor for the class
+        @param self The pointer for the object
+        @param file_name The file name for the archive.  If the file exists
+        new chunks are appended to it
+        @param chunk_size The number of rows stored in each chunk
+        @param scales A dictionary of the resolution each column is quantized
+        to, keyed by the column name.  Columns not specified use the values
+        within DEFAULT_SCALES
+        @param compression_level The zlib compression level from 1 to 9
+        @param processes The number of processes used to compress chunks in
+        parallel.  If None the number of cores is used.  If 1, the default,
+        chunks are compressed within the calling process and written as soon
+        as they are full.  When more than one process is used, close must be
+        called to release them
+        @param debug_level Controls debugging functionality for the class
+        """
+        self.file_name = file_name
+        self.chunk_size = chunk_size
+        self.scales = dict(DEFAULT_SCALES)
+        if scales is not None:
+            self.scales.update(scales)
+        self.compression_level = compression_level
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self.debug_level = debug_level
+        self.info_logger = logger(debug_level=self.debug_level)
+        #The rows which are yet to be written, stored as a list for each
+        #column
+        self._names = None
+        self._buffer = {}
+        self._pool = None
+
+    def append(self, data, start_time=None, sample_rate=None,
+               timestamps=None):
+        """!
+        Add measurements to the archive
+        @param self The pointer for the object
+        @param data A dictionary of lists keyed by column name, such as that
+        returned by TSIMeasure.measure_FTP
+        @param start_time The time of the first sample in seconds since the
+        epoch.  If None the current time is used
+        @param sample_rate The sample rate used for the measurements in
+        milliseconds per sample.  If None all samples are given start_time
+        @param timestamps A list of the time of each sample in seconds since
+        the epoch.  If specified start_time and sample_rate are ignored
+        """
+        data = dict(data)
+        if not data:
+            return
+        rows = len(data.values()[0])
+        if 'time' not in data:
+            if timestamps is None:
+                if start_time is None:
+                    start_time = time.time()
+                if sample_rate is None:
+                    sample_rate = 0
+                timestamps = [start_time + i * sample_rate / 1000.0
+                              for i in range(rows)]
+            data['time'] = timestamps
+        for values in data.values():
+            if len(values) != rows:
+                raise TSIException('All columns and timestamps must have the '
+                                   'same length')
+        names = ['time'] + sorted([name for name in data if name != 'time'])
+        #Check the values before they are buffered so that a bad sample
+        #cannot prevent the buffer from being written
+        columns = {}
+        for name in names:
+            columns[name] = [float(value) for value in data[name]]
+            for value in columns[name]:
+                if math.isnan(value) or math.isinf(value):
+                    raise TSIException('Unable to archive %s value %s' %
+                                       (name, value))
+        if names != self._names:
+            #The selection of columns has changed, finish the current chunk
+            self.flush()
+            self._names = names
+            self._buffer = dict([(name, []) for name in names])
+        for name in names:
+            self._buffer[name].extend(columns[name])
+        #Wait until there is a full chunk for each process so that the
+        #chunks are compressed in parallel
+        if len(self._buffer['time']) >= self.batch_size():
+            self._write(full_only=True)
+
+    def batch_size(self):
+        """!
+        The number of rows buffered before chunks are written to the archive
+        @param self The pointer for the object
+        @return The number of rows
+        """
+        return self.chunk_size * max(self.processes, 1)
+
+    def flush(self):
+        """!
+        Write all buffered rows to the archive
+        @param self The pointer for the object
+        """
+        self._write(full_only=False)
+
+    def close(self):
+        """!
+        Write all buffered rows to the archive and release the worker
+        processes
+        @param self The pointer for the object
+        """
+        self.flush()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _write(self, full_only):
+        """!
+        Encode the buffered rows into chunks and append them to the archive
+        @param self The pointer for the object
+        @param full_only Set to True to only write complete chunks
+        """
+        if self._names is None or not self._buffer['time']:
+            return
+        rows = len(self._buffer['time'])
+        if full_only:
+            end = rows - rows % self.chunk_size
+        else:
+            end = rows
+        jobs = []
+        for start in range(0, end, self.chunk_size):
+            stop = min(start + self.chunk_size, end)
+            columns = [(name, self._buffer[name][start:stop])
+                       for name in self._names]
+            jobs.append((columns, self.scales, self.compression_level))
+        if len(jobs) > 1 and self.processes > 1:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.processes)
+            chunks = self._pool.map(_encode_chunk, jobs)
+        else:
+            chunks = [_encode_chunk(job) for job in jobs]
+        with open(self.file_name, 'ab') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        for name in self._names:
+            del self._buffer[name][:end]
+        self.info_logger.info('Wrote %d rows in %d chunks to %s' %
+                              (end, len(chunks), self.file_name))
+
+
+class TSIArchiveReader(object):
+    """!
+    A class used to query archive files written by TSIArchiver
+    """
+
+    def __init__(self, file_name='archive.tsa'):
+        """!
+        The constructor for the class
+        @param self The pointer for the object
+        @param file_name The file name of the archive
+        """
+        self.file_name = file_name
+
+    def chunks(self):
+        """!
+        Iterate over the chunk headers within the archive
+        @param self The pointer for the object
+        @return A generator of (rows, columns) tuples where columns is a
+        dictionary of column headers keyed by column name.  Each column
+        header is a dictionary containing 'scale', 'min', 'max', 'first',
+        'width', 'offset' and 'length'
+        """
+        header_size = struct.calcsize(CHUNK_HEADER)
+        column_size = struct.calcsize(COLUMN_HEADER)
+        with open(self.file_name, 'rb') as f:
+            while True:
+                header = f.read(header_size)
+                if not header:
+                    return
+                if len(header) != header_size:
+                    raise TSIException('Truncated chunk in %s' %
+                                       self.file_name)
+                magic, rows, count = struct.unpack(CHUNK_HEADER, header)
+                if magic != CHUNK_MAGIC:
+                    raise TSIException('Invalid chunk in %s' %
+                                       self.file_name)
+                columns = {}
+                order = []
+                for i in range(count):
+                    name = f.read(struct.unpack('<B', f.read(1))[0])
+                    scale, minimum, maximum, first, width, length = \
+                        struct.unpack(COLUMN_HEADER, f.read(column_size))
+                    columns[name] = {'scale': scale,
+                                     'min': minimum,
+                                     'max': maximum,
+                                     'first': first,
+                                     'width': width,
+                                     'length': length}
+                    order.append(name)
+                offset = f.tell()
+                for name in order:
+                    columns[name]['offset'] = offset
+                    offset += columns[name]['length']
+                yield rows, columns
+                f.seek(offset)
+
+    def query(self, columns=None, start=None, stop=None, ranges=None):
+        """!
+        Read data from the archive.  Chunks which cannot contain matching rows
+        are skipped using the minimum and maximum stored with each chunk.
+        @param self The pointer for the object
+        @param columns A list of the column names to return.  If None all
+        columns are returned
+        @param start Only return rows at or after this time in seconds since
+        the epoch
+        @param stop Only return rows before this time in seconds since the
+        epoch
+        @param ranges A dictionary of (minimum, maximum) tuples keyed by column
+        name.  Only rows with values inside each range are returned
+        @return A dictionary of lists keyed by column name
+        """
+        limits = {}
+        if ranges is not None:
+            limits.update(ranges)
+        if (start is not None) or (stop is not None):
+            limits['time'] = (start, stop)
+        result = {}
+        with open(self.file_name, 'rb') as f:
+            for rows, headers in self.chunks():
+                #Skip the chunk if it cannot contain any matching rows
+                skip = False
+                for name, (low, high) in limits.items():
+                    if name not in headers:
+                        skip = True
+                    elif (low is not None) and (headers[name]['max'] < low):
+                        skip = True
+                    elif (high is not None) and \
+                            (headers[name]['min'] > high):
+                        skip = True
+                    elif (high is not None) and (name == 'time') and \
+                            (headers[name]['min'] >= high):
+                        skip = True
+                if skip:
+                    continue
+                if columns is None:
+                    names = headers.keys()
+                else:
+                    names = [name for name in columns if name in headers]
+                decoded = {}
+                for name in set(names) | set(limits.keys()):
+                    f.seek(headers[name]['offset'])
+                    decoded[name] = _decode_column(
+                        headers[name], f.read(headers[name]['length']))
+                #Select the matching rows
+                selected = range(rows)
+                for name, (low, high) in limits.items():
+                    values = decoded[name]
+                    if low is not None:
+                        selected = [i for i in selected if values[i] >= low]
+                    if high is not None:
+                        if name == 'time':
+                            selected = [i for i in selected
+                                        if values[i] < high]
+                        else:
+                            selected = [i for i in selected
+                                        if values[i] <= high]
+                for name in names:
+                    values = decoded[name]
+                    result.setdefault(name, []).extend(
+                        [values[i] for i in selected])
+        return result
+
+
+def archive_csv(csv_file, archive_file='archive.tsa', **kwargs):
+    """!
+    Convert a file written by TSILogger.csvLogger into an archive.  The Date
+    and Time columns written with date_time_flag are combined into the time
+    column, all other columns are archived using their header as the name.
+    @param csv_file The file name of the csv file
+    @param archive_file The file name of the archive
+    @param kwargs Additional arguments passed to TSIArchiver.  Unless
+    specified, processes defaults to the number of cores
+    @return The number of rows archived
+    """
+    if not os.path.isfile(csv_file):
+        raise TSIException('Unable to find %s' % csv_file)
+    kwargs.setdefault('processes', None)
+    archiver = TSIArchiver(archive_file, **kwargs)
+    count = 0
+    with open(csv_file, 'rb') as f:
+        reader = csv.reader(f)
+        header = reader.next()
+        data = dict([(name, []) for name in header
+                     if name not in ('Date', 'Time')])
+        timestamps = []
+        for row in reader:
+            if not row:
+                continue
+            row = dict(zip(header, row))
+            if ('Date' in row) and ('Time' in row):
+                stamp = datetime.strptime('%s %s' % (row['Date'],
+                                                     row['Time']),
+                                          '%d/%m/%Y %H:%M:%S')
+                timestamps.append(time.mktime(stamp.timetuple()))
+            else:
+                timestamps.append(time.time())
+            for name in data:
+                data[name].append(float(row[name]))
+            count += 1
+            if count % archiver.batch_size() == 0:
+                archiver.append(data, timestamps=timestamps)
+                data = dict([(name, []) for name in data])
+                timestamps = []
+        if timestamps:
+            archiver.append(data, timestamps=timestamps)
+    archiver.close()
+    return count
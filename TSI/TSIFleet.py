@@ -0,0 +1,191 @@
+#! /usr/bin/env python
+"""
+Python module for the configuration and health checking of a number of TSI
+Flow Meters
+"""
+__author__ = "Ben Johnston"
+__revision__ = "0.1"
+__date__ = ""
+__copyright__ = "GPL License"
+
+##IMPORTS#####################################################################
+from TSILogger import logger
+from datetime import datetime, timedelta
+import threading
+import time
+##############################################################################
+
+
+class TSIFleet(object):
+    """!
+    A class used to configure and check a number of TSIParams devices in
+    parallel.  Each device is handled by its own thread so that the time taken
+    by a sweep is set by the slowest device rather than the number of devices.
+    """
+
+    def __init__(self, devices, debug_level=0):
+        """!
+        The constructor for the class
+        @param self The pointer for the object
+        @param devices A list of TSIParams (or TSIMeasure) instances
+        @param debug_level Controls debugging functionality for the class
+        """
+        self.devices = list(devices)
+        self.debug_level = debug_level
+        self.info_logger = logger(debug_level=self.debug_level)
+        ##@var pending
+        #The threads of devices which timed out during the last sweep and
+        #which are still completing their current command
+        self.pending = []
+
+    def sweep(self, sample_rate=None, flow_rate_type=None, deadline=5.0,
+              cal_interval=365):
+        """!
+        Configure each device and read its identity and calibration details.
+        All devices are handled in parallel and each must complete within
+        deadline seconds of the start of the sweep.  A device which times out
+        is left to finish the command in progress on its own thread, which
+        may take several read timeouts.  Call self.join before using such a
+        device again so that its commands are not interleaved.
+        @param self The pointer for the object
+        @param sample_rate If specified the sample rate passed to
+        set_sample_rate
+        @param flow_rate_type If specified the flow units passed to set_units
+        @param deadline The time in seconds each device has to complete
+        @param cal_interval The number of days after the calibration date at
+        which calibration is overdue
+        @return A list with a report dictionary for each device in the order
+        of self.devices.  Each report contains the keys 'port', 'serial_no',
+        'model_no', 'cal_date', 'cal_overdue', 'firmware_rev', 'sample_rate',
+        'errors' (a dictionary of error messages keyed by step), 'timed_out',
+        'elapsed' and 'ok'
+        """
+        start = time.time()
+        reports = []
+        threads = []
+        for device in self.devices:
+            report = {'port': getattr(device, 'port', None),
+                      'serial_no': None,
+                      'model_no': None,
+                      'cal_date': None,
+                      'cal_overdue': None,
+                      'firmware_rev': None,
+                      'sample_rate': None,
+                      'errors': {},
+                      'timed_out': False,
+                      'elapsed': None,
+                      'ok': False}
+            thread = threading.Thread(target=self._check_device,
+                                      args=(device, report, start,
+                                            start + deadline, sample_rate,
+                                            flow_rate_type, cal_interval))
+            thread.daemon = True
+            thread.start()
+            reports.append(report)
+            threads.append(thread)
+        results = []
+        self.pending = []
+        for thread, report in zip(threads, reports):
+            thread.join(max(start + deadline - time.time(), 0))
+            if thread.is_alive():
+                #The device has not responded in time, report what has been
+                #collected so far
+                report = dict(report, errors=dict(report['errors']))
+                report['timed_out'] = True
+                report['elapsed'] = time.time() - start
+                report['ok'] = False
+                self.pending.append(thread)
+                self.info_logger.info('TSI@%s did not complete within %.1f s'
+                                      % (report['port'], deadline))
+            results.append(report)
+        return results
+
+    def join(self, timeout=None):
+        """!
+        Wait for the devices which timed out during the last sweep to finish
+        the command in progress
+        @param self The pointer for the object
+        @param timeout The time in seconds to wait.  If None wait until all
+        of the devices have finished
+        @return True if all of the devices have finished
+        """
+        end_time = None
+        if timeout is not None:
+            end_time = time.time() + timeout
+        for thread in self.pending:
+            if end_time is None:
+                thread.join()
+            else:
+                thread.join(max(end_time - time.time(), 0))
+        self.pending = [thread for thread in self.pending
+                        if thread.is_alive()]
+        return not self.pending
+
+    def _check_device(self, device, report, start, deadline, sample_rate,
+                      flow_rate_type, cal_interval):
+        """!
+        Configure and check a single device, filling in the report
+        @param self The pointer for the object
+        @param device The TSIParams instance
+        @param report The report dictionary for the device
+        @param start The time the sweep started
+        @param deadline The time by which the device must complete
+        @param sample_rate The sample rate to set or None
+        @param flow_rate_type The flow units to set or None
+        @param cal_interval The calibration interval in days
+        """
+        steps = []
+        if sample_rate is not None:
+            steps.append(('sample_rate', device.set_sample_rate,
+                          (sample_rate,)))
+        if flow_rate_type is not None:
+            steps.append(('units', device.set_units, (flow_rate_type,)))
+        steps.append(('serial_no', device.get_serial_no, ()))
+        steps.append(('model_no', device.get_model_no, ()))
+        steps.append(('cal_date', device.get_cal_date, ()))
+        steps.append(('firmware_rev', device.get_firmware_rev, ()))
+        for name, method, args in steps:
+            if time.time() >= deadline:
+                report['errors'][name] = 'Deadline exceeded'
+                continue
+            try:
+                value = method(*args)
+            except Exception as e:
+                report['errors'][name] = str(e)
+                self.info_logger.info('TSI@%s %s failed: %s' %
+                                      (report['port'], name, e))
+                continue
+            if name == 'sample_rate':
+                report['sample_rate'] = getattr(device, 'sample_rate', None)
+            elif name != 'units':
+                report[name] = value
+        if report['cal_date'] is not None:
+            report['cal_overdue'] = self.cal_overdue(report['cal_date'],
+                                                     cal_interval)
+        report['elapsed'] = time.time() - start
+        report['ok'] = not report['errors']
+
+    def cal_overdue(self, cal_date, cal_interval=365, now=None):
+        """!
+        Check whether the calibration of a device is overdue
+        @param self The pointer for the object
+        @param cal_date The calibration date as returned by get_cal_date in
+        the format 'month/day/year'
+        @param cal_interval The number of days after the calibration date at
+        which calibration is overdue
+        @param now The date to check against.  If None the current date is
+        used
+        @return True if the calibration is overdue, False if not and None if
+        the date could not be read
+        """
+        if now is None:
+            now = datetime.now()
+        try:
+            month, day, year = [int(value) for value in cal_date.split('/')]
+            if year < 100:
+                #Two digit years are assumed to be in the current century
+                year += 2000
+            date = datetime(year, month, day)
+        except ValueError:
+            return None
+        return now > date + timedelta(days=cal_interval)
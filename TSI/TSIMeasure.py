@@ -9,6 +9,7 @@ __copyright__ = "GPL License"
 
 ##IMPORTS#####################################################################
 from TSIParams import TSIParams
+import time
 ##############################################################################
 
 
@@ -54,7 +55,8 @@ class TSIMeasure(TSIParams):
                            serial_port,
                            debug_level)
 
-    def measure_FTP(self, flow=True, temp=True, press=True, samples=1):
+    def measure_FTP(self, flow=True, temp=True, press=True, samples=1,
+                    timeout=None):
         """!
         Measure the flow temperature and pressure at the sample rate.
         @param self The pointer for the object
@@ -62,10 +64,14 @@ class TSIMeasure(TSIParams):
         rate. Note that the minimum number of samples is 1 and the maximum is
         9999, sample values entered outside of these values are capped at the
         closest limit.
+        @param timeout If specified, the time in seconds after which a
+        TSIException is raised if the device is still being read
         @return a dictionary of lists containing the results for each of the
         specified test types.  The keys of the dictionary are 'flow', 'temp'
         and/or 'press' depending upon the tests selected
         """
+        if timeout is not None:
+            end_time = time.time() + timeout
         if samples <= 0:
             signed_samples = 1
         elif samples > 9999:
@@ -119,6 +125,9 @@ class TSIMeasure(TSIParams):
                 result_dict['press'] = []
             #Loop through to get all of the available results
             while True:
+                if (timeout is not None) and (time.time() > end_time):
+                    raise TSIException('Measurement did not complete within '
+                                       '%.1f s' % timeout)
                 #Read the results from the device
                 result = self.read_msg()
                 if result is not '':
@@ -175,9 +184,12 @@ class TSIMeasure(TSIParams):
 
                     yield result_dict
         else:
-            if acknowledge.find('ERR') > 0:
+            if acknowledge == '':
+                #The device did not respond before the timeout
+                err_msg = 'No response received requesting measurement'
+            elif acknowledge.find('ERR') >= 0:
                 error = acknowledge.strip('ERR')
-                err_msg = 'Error %d returned requesting measurement' %\
+                err_msg = 'Error %s returned requesting measurement' %\
                           error
             else:
                 err_msg = 'Unknown response received: %s' % acknowledge
@@ -225,10 +237,13 @@ class TSIMeasure(TSIParams):
                     return results_list
         else:
             #An error occurred
-            if acknowledge.find('ERR') > 0:
+            if acknowledge == '':
+                #The device did not respond before the timeout
+                err_msg = 'No response received requesting measurement'
+            elif acknowledge.find('ERR') >= 0:
                 error = acknowledge.strip('ERR')
-                err_msg = 'Error %d returned requesting measurement' %\
+                err_msg = 'Error %s returned requesting measurement' %\
                           error
             else:
-                err_msg = 'Unknown response received: %s' % err_msg
+                err_msg = 'Unknown response received: %s' % acknowledge
             raise TSIException(err_msg)
@@ -94,12 +94,15 @@ class TSIParams(TSIProtocolLayer):
             return
         else:
             #An error occurred
-            if acknowledge.find('ERR') > 0:
+            if acknowledge == '':
+                #The device did not respond before the timeout
+                err_msg = 'No response received requesting measurement'
+            elif acknowledge.find('ERR') >= 0:
                 error = acknowledge.strip('ERR')
-                err_msg = 'Error %d returned requesting measurement' %\
+                err_msg = 'Error %s returned requesting measurement' %\
                           error
             else:
-                err_msg = 'Unknown response received: %s' % err_msg
+                err_msg = 'Unknown response received: %s' % acknowledge
             raise TSIException(err_msg)
 
     def set_units(self, flow_rate_type=STD_FLOW_RATE):
@@ -125,9 +128,12 @@ class TSIParams(TSIProtocolLayer):
             return
         else:
             #An error occurred
-            if acknowledge.find('ERR') > 0:
+            if acknowledge == '':
+                #The device did not respond before the timeout
+                err_msg = 'No response received requesting measurement'
+            elif acknowledge.find('ERR') >= 0:
                 error = acknowledge.strip('ERR')
-                err_msg = 'Error %d returned requesting measurement' %\
+                err_msg = 'Error %s returned requesting measurement' %\
                           error
             else:
                 err_msg = 'Unknown response received: %s' % acknowledge
@@ -147,12 +153,15 @@ class TSIParams(TSIProtocolLayer):
             return self.read_msg().strip(' ')
         else:
             #An error occurred
-            if acknowledge.find('ERR') > 0:
+            if acknowledge == '':
+                #The device did not respond before the timeout
+                err_msg = 'No response received requesting serial number'
+            elif acknowledge.find('ERR') >= 0:
                 error = acknowledge.strip('ERR')
-                err_msg = 'Error %d returned requesting serial number' %\
+                err_msg = 'Error %s returned requesting serial number' %\
                           error
             else:
-                err_msg = 'Unknown response received: %s' % err_msg
+                err_msg = 'Unknown response received: %s' % acknowledge
             raise TSIException(err_msg)
 
     def get_cal_date(self):
@@ -170,12 +179,15 @@ class TSIParams(TSIProtocolLayer):
             return self.read_msg().strip(' ')
         else:
             #An error occurred
-            if acknowledge.find('ERR') > 0:
+            if acknowledge == '':
+                #The device did not respond before the timeout
+                err_msg = 'No response received requesting calibration date'
+            elif acknowledge.find('ERR') >= 0:
                 error = acknowledge.strip('ERR')
-                err_msg = 'Error %d returned requesting calibration date' %\
+                err_msg = 'Error %s returned requesting calibration date' %\
                           error
             else:
-                err_msg = 'Unknown response received: %s' % err_msg
+                err_msg = 'Unknown response received: %s' % acknowledge
             raise TSIException(err_msg)
 
     def get_model_no(self):
@@ -192,12 +204,15 @@ class TSIParams(TSIProtocolLayer):
             return self.read_msg().strip(' ')
         else:
             #An error occurred
-            if acknowledge.find('ERR') > 0:
+            if acknowledge == '':
+                #The device did not respond before the timeout
+                err_msg = 'No response received requesting the model number'
+            elif acknowledge.find('ERR') >= 0:
                 error = acknowledge.strip('ERR')
-                err_msg = 'Error %d returned requesting the model number' %\
+                err_msg = 'Error %s returned requesting the model number' %\
                           error
             else:
-                err_msg = 'Unknown response received: %s' % err_msg
+                err_msg = 'Unknown response received: %s' % acknowledge
             raise TSIException(err_msg)
 
     def get_firmware_rev(self):
@@ -214,10 +229,14 @@ class TSIParams(TSIProtocolLayer):
             return self.read_msg().strip(' ')
         else:
             #An error occurred
-            if acknowledge.find('ERR') > 0:
+            if acknowledge == '':
+                #The device did not respond before the timeout
+                err_msg = 'No response received requesting the ' \
+                          'firmware revision'
+            elif acknowledge.find('ERR') >= 0:
                 error = acknowledge.strip('ERR')
-                err_msg = 'Error %d returned requesting the firmware revision' %\
+                err_msg = 'Error %s returned requesting the firmware revision' %\
                           error
             else:
-                err_msg = 'Unknown response received: %s' % err_msg
+                err_msg = 'Unknown response received: %s' % acknowledge
             raise TSIException(err_msg)
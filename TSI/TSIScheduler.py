@@ -0,0 +1,431 @@
+#! /usr/bin/env python
+"""
+Python module for scheduling periodic measurements across a number of TSI
+Flow Meters
+"""
+__author__ = "Ben Johnston"
+__revision__ = "0.1"
+__date__ = ""
+__copyright__ = "GPL License"
+
+##IMPORTS#####################################################################
+from TSILogger import logger
+import threading
+import Queue
+import heapq
+import time
+import math
+##############################################################################
+
+
+#Define an exception class
+class TSIException(Exception):
+    """!
+    Class to handle exceptions within the TSI module
+    """
+    def __init__(self, msg=None):
+        """!
+        The constructor for the class.
+        @param self The pointer for the object
+        @param msg The message to be displayed within the exception
+        """
+        Exception.__init__(self, msg)
+        ##@var msg
+        #The message to report for the exception
+        self.msg = msg
+
+    def __str__(self):
+        """!
+        This method provides a string representation of the exception
+        @param self The pointer for the object
+        @return A string representation of the exceptions
+        """
+        return self.msg
+
+
+class TSIJob(object):
+    """!
+    A declarative description of a periodic measurement to be taken from a
+    single TSIMeasure device.  Jobs are handed to a TSIScheduler which
+    executes them every period seconds.
+    """
+
+    #Job types
+    FTP = 'FTP'
+    VOLUME = 'volume'
+
+    def __init__(self, device, kind=FTP, period=60.0, samples=1,
+                 duration=None, flow=True, temp=True, press=True,
+                 callback=None, error_callback=None, priority=0,
+                 start_delay=0.0, name=None):
+        """!
+        The constructor for the class
+        @param self The pointer for the object
+        @param device The TSIMeasure instance the job is executed against
+        @param kind TSIJob.FTP to call measure_FTP or TSIJob.VOLUME to call
+        measure_volume
+        @param period The time in seconds between the start of each run
+        @param samples The number of samples collected on each run
+        @param duration If specified, the length of each run in seconds.  The
+        number of samples is then computed from device.sample_rate, which
+        must have been configured with set_sample_rate
+        @param flow Set to True to collect flow measurements (FTP only)
+        @param temp Set to True to collect temperature measurements (FTP only)
+        @param press Set to True to collect pressure measurements (FTP only)
+        @param callback Called as callback(job, result) after each run where
+        result is the dictionary of lists returned by measure_FTP or the list
+        returned by measure_volume
+        @param error_callback Called as error_callback(job, exception) if a
+        run fails.  If None the failure is logged and the job continues
+        @param priority Jobs which fall due at the same time are executed in
+        ascending order of priority
+        @param start_delay The time in seconds before the first run
+        @param name An optional name used to identify the job in logs
+        """
+        if kind not in (TSIJob.FTP, TSIJob.VOLUME):
+            raise TSIException('Unknown job type: %s' % kind)
+        if period <= 0:
+            raise TSIException('The job period must be greater than zero')
+        if (kind == TSIJob.FTP) and (not flow) and (not temp) and \
+                (not press):
+            raise TSIException('No measurements selected for FTP job')
+        ##@var device
+        #The device the job is executed against
+        self.device = device
+        ##@var kind
+        #The measurement type of the job
+        self.kind = kind
+        ##@var period
+        #The time in seconds between each run
+        self.period = float(period)
+        if duration is not None:
+            if getattr(device, 'sample_rate', None) is None:
+                raise TSIException('The sample rate must be set with '
+                                   'set_sample_rate to specify a duration')
+            samples = int(math.ceil(duration * 1000.0 / device.sample_rate))
+        ##@var samples
+        #The number of samples collected on each run
+        self.samples = min(max(int(samples), 1), 9999)
+        ##@var channels
+        #The measurement channels selected for the job
+        self.channels = []
+        if flow:
+            self.channels.append('flow')
+        if temp:
+            self.channels.append('temp')
+        if press:
+            self.channels.append('press')
+        self.callback = callback
+        self.error_callback = error_callback
+        self.priority = priority
+        self.start_delay = float(start_delay)
+        if name is None:
+            name = '%s@%s' % (kind, getattr(device, 'port', None))
+        self.name = name
+        ##@var active
+        #Set to False once the job is removed from the scheduler
+        self.active = True
+
+    def compatible(self, other):
+        """!
+        Check whether the job can share a single acquisition with another job
+        @param self The pointer for the object
+        @param other The other TSIJob
+        @return True if both jobs use the same device and measurement type
+        """
+        return (self.device is other.device) and (self.kind == other.kind)
+
+
+class TSIScheduler(object):
+    """!
+    A scheduler which executes TSIJob instances on a small pool of worker
+    threads.  Pending jobs are kept in a priority queue ordered by the time
+    they next fall due.  Compatible jobs which fall due together on the same
+    device are merged into a single acquisition.
+    """
+
+    def __init__(self, workers=4, merge_window=0.05, timeout_margin=2.0,
+                 debug_level=0):
+        """!
+        The constructor for the class
+        @param self The pointer for the object
+        @param workers The number of worker threads used to run jobs
+        @param merge_window Compatible jobs on a device falling due within
+        this many seconds of each other are merged into one acquisition
+        @param timeout_margin The time in seconds allowed on top of the
+        expected length of an acquisition before it is abandoned
+        @param debug_level Controls debugging functionality for the class
+        """
+        self.debug_level = debug_level
+        self.info_logger = logger(debug_level=self.debug_level)
+        self.workers = workers
+        self.merge_window = merge_window
+        self.timeout_margin = timeout_margin
+        #The priority queue of (due time, priority, sequence, job)
+        self._queue = []
+        self._sequence = 0
+        self._condition = threading.Condition()
+        #Batches of jobs ready to be executed by the workers, created by
+        #self.start
+        self._work = None
+        #The devices with an acquisition in progress.  A serial port is only
+        #used by one worker at a time, batches for a busy device are held in
+        #the priority queue until it is free
+        self._busy = set()
+        self._threads = []
+        self._running = False
+
+    def add_job(self, job):
+        """!
+        Add a job to the scheduler
+        @param self The pointer for the object
+        @param job The TSIJob to add
+        @return The job
+        """
+        with self._condition:
+            job.active = True
+            self._push(job, time.time() + job.start_delay)
+            self._condition.notify()
+        return job
+
+    def remove_job(self, job):
+        """!
+        Remove a job from the scheduler.  A run of the job which is already in
+        progress is allowed to complete.
+        @param self The pointer for the object
+        @param job The TSIJob to remove
+        """
+        with self._condition:
+            job.active = False
+            self._queue = [entry for entry in self._queue
+                           if entry[3] is not job]
+            heapq.heapify(self._queue)
+            self._condition.notify()
+
+    def start(self):
+        """!
+        Start the dispatcher and worker threads
+        @param self The pointer for the object
+        """
+        if self._running:
+            return
+        self._running = True
+        #Any device left busy by a previous run is released
+        self._busy.clear()
+        #Use a new queue so that no batches or stop requests are carried over
+        #from a previous run
+        self._work = Queue.Queue()
+        for i in range(self.workers):
+            worker = threading.Thread(target=self._worker,
+                                      args=(self._work,),
+                                      name='TSIScheduler-worker-%d' % i)
+            worker.daemon = True
+            worker.start()
+            self._threads.append(worker)
+        dispatcher = threading.Thread(target=self._dispatcher,
+                                      args=(self._work,),
+                                      name='TSIScheduler-dispatcher')
+        dispatcher.daemon = True
+        dispatcher.start()
+        self._threads.append(dispatcher)
+
+    def stop(self, wait=True):
+        """!
+        Stop the scheduler.  Runs which are in progress are allowed to
+        complete and their jobs are kept in the priority queue, so they resume
+        when the scheduler is started again.
+        @param self The pointer for the object
+        @param wait Set to True to block until all threads have finished
+        """
+        with self._condition:
+            if not self._running:
+                return
+            self._running = False
+            self._condition.notify_all()
+        for i in range(self.workers):
+            self._work.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
+
+    def _push(self, job, due):
+        """!
+        Add a job to the priority queue
+        @param self The pointer for the object
+        @param job The TSIJob to add
+        @param due The time at which the job next falls due
+        """
+        heapq.heappush(self._queue, (due, job.priority, self._sequence, job))
+        self._sequence += 1
+
+    def _next_entry(self):
+        """!
+        Find the first entry in the priority queue whose device is not busy.
+        The heap is walked in order from the root, only visiting the children
+        of entries which are skipped.
+        @param self The pointer for the object
+        @return The entry or None if there is no such entry
+        """
+        if not self._queue:
+            return None
+        candidates = [(self._queue[0], 0)]
+        while candidates:
+            entry, index = heapq.heappop(candidates)
+            if id(entry[3].device) not in self._busy:
+                return entry
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(self._queue):
+                    heapq.heappush(candidates, (self._queue[child], child))
+        return None
+
+    def _dispatcher(self, work):
+        """!
+        Pop jobs from the priority queue as they fall due and pass them to the
+        workers, merging compatible jobs into a single batch.  Jobs for a
+        device which is busy are held until the device is free.
+        @param self The pointer for the object
+        @param work The queue the batches are passed to the workers on
+        """
+        while True:
+            with self._condition:
+                #A dispatcher left over from a previous run stops once the
+                #scheduler has been restarted with a new queue
+                while self._running and (work is self._work):
+                    entry = self._next_entry()
+                    if entry is None:
+                        self._condition.wait()
+                        continue
+                    delay = entry[0] - time.time()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+                if (not self._running) or (work is not self._work):
+                    return
+                self._queue.remove(entry)
+                due, priority, sequence, job = entry
+                batch = [(due, job)]
+                #Collect the compatible jobs which fall due within the merge
+                #window
+                remaining = []
+                for entry in self._queue:
+                    if (entry[0] <= due + self.merge_window) and \
+                            entry[3].compatible(job):
+                        batch.append((entry[0], entry[3]))
+                    else:
+                        remaining.append(entry)
+                heapq.heapify(remaining)
+                self._queue = remaining
+                self._busy.add(id(job.device))
+                #Queued while running is held so that the batch is always
+                #ahead of the stop requests from self.stop
+                work.put(batch)
+
+    def _worker(self, work):
+        """!
+        Execute batches of jobs passed from the dispatcher
+        @param self The pointer for the object
+        @param work The queue the batches are received on
+        """
+        while True:
+            batch = work.get()
+            if batch is None:
+                return
+            jobs = [job for due, job in batch if job.active]
+            try:
+                if jobs:
+                    self._run_batch(jobs)
+            finally:
+                with self._condition:
+                    self._busy.discard(id(batch[0][1].device))
+                    for due, job in batch:
+                        if job.active:
+                            self._push(job, self._next_due(job, due))
+                    self._condition.notify()
+
+    def _next_due(self, job, due):
+        """!
+        Compute the next time a job falls due.  Runs are kept on a fixed grid
+        of period seconds from the first run, skipping any runs that were
+        missed because a previous run overran.
+        @param self The pointer for the object
+        @param job The TSIJob
+        @param due The time at which the job last fell due
+        @return The time at which the job next falls due
+        """
+        next_due = due + job.period
+        now = time.time()
+        if next_due < now:
+            next_due += job.period * math.ceil((now - next_due) / job.period)
+        return next_due
+
+    def _run_batch(self, jobs):
+        """!
+        Perform a single acquisition for a batch of compatible jobs and pass
+        each job its share of the results
+        @param self The pointer for the object
+        @param jobs A list of compatible TSIJob instances
+        """
+        device = jobs[0].device
+        samples = max([job.samples for job in jobs])
+        try:
+            if jobs[0].kind == TSIJob.FTP:
+                channels = set()
+                for job in jobs:
+                    channels.update(job.channels)
+                result = self._acquire_FTP(device, channels, samples)
+            else:
+                result = device.measure_volume(samples)
+        except Exception as e:
+            for job in jobs:
+                self.info_logger.info('Job %s failed: %s' % (job.name, e))
+                if job.error_callback is None:
+                    continue
+                try:
+                    job.error_callback(job, e)
+                except Exception as callback_error:
+                    self.info_logger.info('Error callback for job %s '
+                                          'failed: %s' %
+                                          (job.name, callback_error))
+            return
+        for job in jobs:
+            if job.callback is None:
+                continue
+            if job.kind == TSIJob.FTP:
+                job_result = dict([(key, result[key][:job.samples])
+                                   for key in job.channels])
+            else:
+                job_result = result[:job.samples]
+            try:
+                job.callback(job, job_result)
+            except Exception as e:
+                self.info_logger.info('Callback for job %s failed: %s' %
+                                      (job.name, e))
+
+    def _acquire_FTP(self, device, channels, samples):
+        """!
+        Collect samples from measure_FTP for the selected channels.  The
+        acquisition is abandoned if it has not completed within the expected
+        time plus self.timeout_margin.
+        @param self The pointer for the object
+        @param device The TSIMeasure instance
+        @param channels A collection of the channel names to measure
+        @param samples The number of samples to collect
+        @return The dictionary of lists returned by measure_FTP
+        """
+        #If the sample rate has not been set assume the slowest rate
+        sample_rate = getattr(device, 'sample_rate', 1000)
+        timeout = samples * sample_rate / 1000.0 + self.timeout_margin
+        end_time = time.time() + timeout
+        result = {}
+        for result in device.measure_FTP(flow='flow' in channels,
+                                         temp='temp' in channels,
+                                         press='press' in channels,
+                                         samples=samples,
+                                         timeout=timeout):
+            if min([len(values) for values in result.values()]) >= samples:
+                break
+            if time.time() > end_time:
+                raise TSIException('Measurement did not complete within '
+                                   '%.1f s' % timeout)
+        return result
@@ -11,4 +11,8 @@ import TSIProtocolLayer
 import TSIMeasure
 import TSIParams
 import TSILogger
+import TSIScheduler
+import TSIArchive
+import TSIFleet
+import TSIAlarm
 ##############################################################################